@@ -1,135 +1,250 @@
-from collections import deque
-
-from .utilities import popleft_n, read_from_buffer
+from .utilities import count_byte, extend_match, hash3, read_from_buffer
 from .pointer import Pointer
 
+from array import array
 import sys
 
+# max number of candidates to check in a hash chain
+MAX_CHAIN = 256
+# once a match this long is found, only check half of the candidates
+GOOD_MATCH = 8
+# after every 2 ** SKIP_SHIFT positions without a match, double the number of positions skipped
+# until the next match, up to MAX_SKIP
+SKIP_SHIFT = 5
+MAX_SKIP = 32
+
+
+def find_match(data, win_lo, i, buf_end, head, prev, length_shortest):
+    """
+    Find a match (both inclusive) longer than SIZE_MIN_MATCH and shorter than SIZE_MAX_MATCH
+    The string starts from data[i]
+
+    The sliding window is data[win_lo:i] and the read ahead buffer is data[i:buf_end]
+
+    :param data: The whole input
+    :type data: bytes | mmap.mmap
+    :param win_lo: Start of the sliding window (inclusive)
+    :type win_lo: int
+    :param i: Current position, end of the sliding window and start of the read ahead buffer
+    :type i: int
+    :param buf_end: End of the read ahead buffer (exclusive)
+    :type buf_end: int
+    :param head: head[hash] is the most recent position of a hash
+    :type head: list[int]
+    :param prev: prev[pos % size of sliding window] is the previous position with the same hash as pos
+    :type prev: list[int]
+    :param length_shortest: Length of the shortest match possible
+    :type length_shortest: int
+    :return: A tuple contains (offset, length) or None when there is no match
+    :rtype: tuple | None
+    """
+    # the read ahead buffer is already bounded by MAX_LENGTH
+    length_max = buf_end - i
+
+    # too short for a match
+    if length_max < length_shortest:
+        return None
 
-class Compressor:
-    def __init__(self, buffered_reader, bits_windows=12):
-        self.pointer = Pointer(bits_windows)
-        self.escape_char = b"\xCC"
-        self.content = deque(read_from_buffer(buffered_reader))
-        self.result = bytearray()
+    size_window = len(prev)
+    length_best = length_shortest - 1
+    result = None
+
+    # walk the hash chain, from the most recent position to the oldest one
+    # so that the rightmost one is used when multiple matches have the same length
+    pos = head[hash3(data, i)]
+    depth = 0
+    max_chain = MAX_CHAIN
+    while pos >= win_lo and depth < max_chain:
+        # don't go outside of the sliding window and read ahead buffer
+        limit = min(length_max, i - pos)
+
+        # only a candidate matching the byte right after the best match can be longer
+        # this skips most candidates without extending them
+        if limit > length_best and data[pos + length_best] == data[i + length_best]:
+            # positions with the same hash might not match at all
+            length = extend_match(data, pos, i, limit)
+
+            if length > length_best:
+                length_best = length
+                offset = i - pos - 1
+                result = offset, length
+
+                # can't be any longer, older ones can only tie with it
+                if length_best == length_max:
+                    break
+
+                # good enough, don't bother with the whole chain
+                if length_best >= GOOD_MATCH:
+                    max_chain = MAX_CHAIN // 2
+
+        pos = prev[pos % size_window]
+        depth += 1
+
+    return result
+
+
+def find_pointers(data, size_window, length_longest, length_shortest):
+    """
+    Find the pointers to encode the whole input with
+
+    Everything between two pointers is output without compress/encode
+
+    :param data: The whole input
+    :type data: bytes | mmap.mmap
+    :param size_window: Size of sliding window
+    :type size_window: int
+    :param length_longest: Length of the longest match possible
+    :type length_longest: int
+    :param length_shortest: Length of the shortest match possible
+    :type length_shortest: int
+    :return: Positions, offsets and lengths of the pointers, as 3 arrays of the same size
+    :rtype: tuple
+    """
+    size_data = len(data)
+    positions = array("q")
+    offsets = array("l")
+    lengths = array("l")
+
+    # init hash chain
+    head = [-1] * 65536
+    prev = [-1] * size_window
+
+    # current position, which splits the input into sliding window and read ahead buffer
+    i = 0
+    # number of positions to skip after a miss, and number of positions missed in a row
+    # incompressible data is skipped faster and faster
+    skip = 1
+    miss_run = 0
+    while i < size_data:
+        win_lo = max(0, i - size_window)
+        buf_end = min(size_data, i + length_longest)
+
+        result = find_match(data, win_lo, i, buf_end, head, prev, length_shortest)
 
-    def find_match(self, sliding_window, buffer):
         """
-        Find a match (both inclusive) longer than SIZE_MIN_MATCH and shorter than SIZE_MAX_MATCH
-        The string starts from buffer[0]
-
-        :param sliding_window: The sliding window buffer
-        :type sliding_window: deque
-        :param buffer: The read ahead buffer
-        :type buffer: deque
-        :return: A tuple contains (offset, length) or None when there is no match
-        :rtype: tuple | None
+        no match found, it will be output without compress/encode with the following literals
         """
-        size_window = len(sliding_window)
-        size_buffer = len(buffer)
-
-        cur_sliding_window = size_window - 1
-
-        # we are scanning from the right of sliding window
-        while cur_sliding_window >= 0:
-
-            # no match, move to next
-            if sliding_window[cur_sliding_window] != buffer[0]:
-                cur_sliding_window -= 1
-                continue
-
-            # we might found a match, start matching now
-            cur_buffer = 0
-            # we don't want to mess cur_sliding_window before finding a solid match
-            tmp_sliding_window = cur_sliding_window
-
-            """
-            Matching
-            """
-            # don't go outside of the sliding window and read ahead buffer
-            # and keep the length of match less that MAX_LENGTH
-            while tmp_sliding_window < size_window and cur_buffer < size_buffer \
-                    and cur_buffer < self.pointer.length_longest_match() \
-                    and sliding_window[tmp_sliding_window] == buffer[cur_buffer]:
-                cur_buffer += 1
-                tmp_sliding_window += 1
-
+        if result is None:
+            length = min(skip, size_data - i)
+            # skipped positions are not searched, don't hash them either
+            size_hash = 1
+
+            miss_run += length
+            skip = min(MAX_SKIP, 1 << (miss_run >> SKIP_SHIFT))
+        else:
             """
-            End of matching
+            match found, compress/encode it
             """
-            # if length < SIZE_MIN_MATCH, ignore this match
-            if cur_buffer < self.pointer.length_shortest_match():
-                cur_sliding_window -= 1
-                continue
+            offset, length = result
+            size_hash = length
+
+            positions.append(i)
+            offsets.append(offset)
+            lengths.append(length)
+
+            skip = 1
+            miss_run = 0
+
+        # move number of "length" chars from buffer into sliding window
+        # need 3 bytes to hash
+        for j in range(i, min(i + size_hash, size_data - 2)):
+            h = hash3(data, j)
+            prev[j % size_window] = head[h]
+            head[h] = j
+
+        i += length
+
+    return positions, offsets, lengths
+
+
+def write_literals(view, out, data, start, end, escape_char, escaped):
+    """
+    Output data[start:end] without compress/encode, escaping every escape char
+
+    :param view: A memoryview of the output, large enough to hold the literals
+    :type view: memoryview
+    :param out: Write cursor of the output
+    :type out: int
+    :param data: The whole input
+    :type data: bytes | mmap.mmap
+    :param start: Start of the literals (inclusive)
+    :type start: int
+    :param end: End of the literals (exclusive)
+    :type end: int
+    :param escape_char: The escape char
+    :type escape_char: bytes
+    :param escaped: What an escape char is encoded into
+    :type escaped: bytes
+    :return: The write cursor after the literals
+    :rtype: int
+    """
+    literals = data[start:end]
+
+    # \xCC -> \xCC\x00\x00
+    if escape_char in literals:
+        literals = escaped.join(literals.split(escape_char))
+
+    view[out:out + len(literals)] = literals
+    return out + len(literals)
 
-            # we find a valid match, now encode it
-            offset = len(sliding_window) - (tmp_sliding_window - cur_buffer) - 1
-            length = cur_buffer
-            return offset, length
 
-        return None
+class Compressor:
+    def __init__(self, buffered_reader, bits_windows=12):
+        self.pointer = Pointer(bits_windows)
+        self.escape_char = b"\xCC"
+        self.content = read_from_buffer(buffered_reader)
+        self.result = bytearray()
 
     def compress(self):
-        encoded = self.result
+        data = self.content
+        size_data = len(data)
 
         """
-        1. init sliding window and read ahead buffer
+        1. Find all pointers
         """
-        sliding_window = deque(maxlen=self.pointer.size_sliding_window())
-        buffer = deque(maxlen=self.pointer.size_buffer())
+        positions, offsets, lengths = find_pointers(data,
+                                                    self.pointer.size_sliding_window(),
+                                                    self.pointer.length_longest_match(),
+                                                    self.pointer.length_shortest_match())
 
         """
-        2. init read ahead buffer
+        2. Init the output
         """
-        # fill read ahead buffer
-        buffer.extend(popleft_n(self.content, self.pointer.size_buffer()))
+        escape_char = self.escape_char
+        escaped = escape_char + bytes(self.pointer.size)
+        encode = self.pointer.encode
+        size_pointer = self.pointer.size + 1
+
+        # a pointer is always shorter than the match it replaces, so the output is at most
+        # the input with every escape char escaped, plus the size of sliding window
+        self.result = bytearray(1 + size_data + count_byte(data, escape_char) * self.pointer.size)
+        view = memoryview(self.result)
 
         """
-        3. Start the encoding loop
+        3. Output literals and pointers
         """
         # before start, encode size of sliding window using 1 byte
-        encoded.append(self.pointer.bits_offset)
+        view[0] = self.pointer.bits_offset
+        # write cursor of the output
+        out = 1
 
-        while len(buffer) > 0:
-            result = self.find_match(sliding_window, buffer)
-
-            """
-            no match found, simply output without compress/encode
-            """
-            if result is None:
-                # remove one from buffer, put it into sliding window
-                head = buffer.popleft()
-                sliding_window.append(head)
-
-                # output to encoded
-                # escape char
-                if head == self.pointer.ESCAPE_CHAR:
-                    # \xCC -> \xCC\x00\x00
-                    encoded.append(self.pointer.ESCAPE_CHAR)
-                    encoded.extend(bytes(b"\x00") * self.pointer.size)
-                else:
-                    encoded.append(head)
-
-                # read next char from input
-                if len(self.content) > 0:
-                    buffer.append(self.content.popleft())
-
-                # back to find next match
-                continue
-
-            """
-            match found, compress/encode it
-            """
-            offset, length = result
+        # start of the literals not yet written to encoded
+        literal_start = 0
+        for position, offset, length in zip(positions, offsets, lengths):
+            # output literals before this pointer
+            out = write_literals(view, out, data, literal_start, position, escape_char, escaped)
+            literal_start = position + length
 
             # output this pointer
-            encoded.extend(self.pointer.encode(offset, length))
+            view[out:out + size_pointer] = encode(offset, length)
+            out += size_pointer
 
-            # remove number of "length" elements from buffer, put them into sliding window
-            sliding_window.extend(popleft_n(buffer, length))
+        # output remaining literals
+        out = write_literals(view, out, data, literal_start, size_data, escape_char, escaped)
 
-            # move following text into buffer
-            buffer.extend(popleft_n(self.content, length))
+        # drop the unused space
+        view.release()
+        del self.result[out:]
 
     def run(self):
         self.compress()
@@ -165,37 +280,47 @@ class Decompressor:
         # before we start, decode the size of sliding window
         self.pointer = Pointer(self.content[0])
 
+        content = self.content
+        result = self.result
+        escape_char = self.pointer.ESCAPE_CHAR
+        escape = bytes([escape_char])
+        size = self.pointer.size
+        escaped = bytes(size)
+
         cur = 1
-        while cur < len(self.content):
-            head = self.content[cur]
+        while cur < len(content):
             """
             Decode non-pointers
             """
-            if head != self.pointer.ESCAPE_CHAR:
-                self.result.append(head)
-                cur += 1
-                continue
+            # copy everything up to the next escape char at once
+            nxt = content.find(escape, cur)
+            if nxt == -1:
+                result.extend(content[cur:])
+                break
+
+            result.extend(content[cur:nxt])
+            cur = nxt
 
             # If is escaped char
-            if sum(self.content[cur + 1: cur + self.pointer.size + 1]) == 0:
-                self.result.append(self.pointer.ESCAPE_CHAR)
-                cur += self.pointer.size + 1
+            if content[cur + 1: cur + size + 1] == escaped:
+                result.append(escape_char)
+                cur += size + 1
                 continue
 
             """
             Decode pointer
             """
-            barr = bytearray(self.content[cur: cur + self.pointer.size + 1])
+            barr = content[cur: cur + size + 1]
             # move cursor to the next position
-            cur += self.pointer.size + 1
+            cur += size + 1
 
             # decode the pointer information
             offset, length = self.pointer.decode(barr)
-            start = len(self.result) - offset - 1
+            start = len(result) - offset - 1
             end = start + length
 
             # copy the content from previous location
-            self.result.extend(self.result[start:end])
+            result.extend(result[start:end])
 
     def write_to_file(self, output):
         # store the bytearray to file
@@ -1,4 +1,3 @@
-from .utilities import int2str
 import math
 
 
@@ -59,16 +58,10 @@ class Pointer:
         # map the range of length into correct one
         length -= self.length_shortest_match()
 
-        # convert number into binary string
-        bstr = int2str(offset, self.bits_offset) + int2str(length, self.bits_length)
+        # offset takes the high bits, length takes the low bits
+        value = (offset << self.bits_length) | length
 
-        barr = bytearray([0] * (self.size + 1))
-
-        barr[0] = self.ESCAPE_CHAR
-        for i in range(1, len(barr)):
-            barr[i] = int(bstr[(i - 1) * 8:i * 8], 2)
-
-        return barr
+        return bytearray([self.ESCAPE_CHAR]) + value.to_bytes(self.size, byteorder="big")
 
     def decode(self, arr_bytes):
         """
@@ -79,9 +72,9 @@ class Pointer:
         :return: offset, length as a tuple
         :rtype: tuple
         """
-        bstr = "".join([int2str(n, 8) for n in arr_bytes[1:]])
+        value = int.from_bytes(arr_bytes[1:self.size + 1], byteorder="big")
 
-        offset = int(bstr[:self.bits_offset], 2)
-        length = int(bstr[self.bits_offset:], 2)
+        offset = value >> self.bits_length
+        length = value & ((1 << self.bits_length) - 1)
 
         return offset, length + self.length_shortest_match()
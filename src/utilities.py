@@ -1,38 +1,83 @@
+import mmap
+
+
 def read_from_buffer(buffer):
+    """
+    Read the whole content of buffer
+
+    Regular files are memory mapped instead of being read into memory
+
+    :param buffer: the input
+    :type buffer: io.BufferedReader
+    :return: the content
+    :rtype: bytes | mmap.mmap
+    """
+    try:
+        # a memory map always starts from the beginning of the file
+        if buffer.tell() == 0:
+            return mmap.mmap(buffer.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # not a regular file (stdin, BytesIO...), or an empty file
+        pass
+
     return buffer.read()
 
 
-def int2str(number, length):
+def count_byte(data, char):
     """
-    Convert number into binary string, and pad with leading 0 if binary string shorter than length
+    Count how many times char appears in data
+
+    mmap has no count(), so it is counted one chunk at a time
 
-    :param number:
-    :type number: int
-    :param length:
-    :type length: int
-    :return: The binary string representation of number
-    :rtype: str
+    :param data: the input
+    :type data: bytes | mmap.mmap
+    :param char: a single byte
+    :type char: bytes
+    :return: number of char in data
+    :rtype: int
     """
-    number = "{0:b}".format(number)
-    return "0" * (length - len(number)) + number
+    if isinstance(data, bytes):
+        return data.count(char)
 
+    size_chunk = 1 << 20
+    return sum(data[i:i + size_chunk].count(char) for i in range(0, len(data), size_chunk))
 
-def popleft_n(queue, n):
+
+def extend_match(data, p, q, limit):
     """
-    Pop n elements from deque
+    Count how many bytes data[p:] and data[q:] have in common, up to limit
+
+    Compares slices of 16, 8, 4 and then 1 byte, so most of the comparing is done by bytes equality
 
-    :param queue: the buffer
-    :type queue: deque
-    :param n: number of element to pop
-    :type n: int
-    :return: the popped elements
-    :rtype: list[str]
+    :param data: the input
+    :type data: bytes | mmap.mmap
+    :param p: start of the first string
+    :type p: int
+    :param q: start of the second string
+    :type q: int
+    :param limit: maximum number of bytes to compare
+    :type limit: int
+    :return: length of the common prefix
+    :rtype: int
     """
-    ret = []
+    length = 0
+
+    for step in (16, 8, 4, 1):
+        while length + step <= limit and data[p + length:p + length + step] == data[q + length:q + length + step]:
+            length += step
+
+    return length
 
-    for _ in range(n):
-        if len(queue) == 0:
-            break
-        ret.append(queue.popleft())
 
-    return ret
+def hash3(data, i):
+    """
+    Hash the 3 bytes starting from data[i] into 16 bits
+
+    :param data: the input
+    :type data: bytes | mmap.mmap
+    :param i: position of the first byte
+    :type i: int
+    :return: the hash
+    :rtype: int
+    """
+    return ((data[i] | (data[i + 1] << 8)) + (data[i + 2] << 4)) & 0xFFFF